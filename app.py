@@ -6,12 +6,20 @@ st.set_page_config(page_title='HR Chatbot Demo', layout='centered')
 st.title('Intelligent HR Assistant — Demo')
 st.write('Ask payroll or HR-related questions (leave balance, employee details, payroll queries).')
 
-# Initialize Chatbot
-bot = HRChatbot()
+# Initialize Chatbot once and reuse it across reruns; Streamlit re-executes
+# this script on every interaction, so an uncached constructor would re-read
+# the CSVs and re-fit TF-IDF each time.
+@st.cache_resource
+def get_bot():
+    return HRChatbot()
 
-# Store chat history
+bot = get_bot()
+
+# Store chat history and per-session follow-up context (the bot instance is
+# shared, so intent memory lives in session state, not on the bot)
 if 'history' not in st.session_state:
     st.session_state.history = []
+st.session_state.setdefault('ctx', bot.new_context())
 
 # Chat input form
 with st.form('chat_form', clear_on_submit=True):
@@ -20,7 +28,7 @@ with st.form('chat_form', clear_on_submit=True):
 
 # Process message
 if submitted and user_input:
-    resp = bot.retrieve(user_input)
+    resp = bot.retrieve(user_input, st.session_state.ctx)
     st.session_state.history.append(('You', user_input))
     st.session_state.history.append(('Bot', resp))
 
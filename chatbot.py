@@ -1,38 +1,168 @@
-import pandas as pd
+import ahocorasick
+import bm25s
 import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from fuzzywuzzy import fuzz
+import os
+import pickle
 import re
+from functools import lru_cache
 
 class HRChatbot:
     """
     HRChatbot with:
-    - FAQ retrieval (TF-IDF + fuzzy)
+    - FAQ retrieval (BM25 + char n-gram fallback)
     - Rule-based handlers
-    - Short-term memory (remembers last intent/entity for 1 follow-up turn)
+    - Short-term memory (remembers last intent/entity for 1 follow-up turn,
+      held in a caller-owned context dict so one shared bot instance can
+      serve many sessions)
     """
 
     def __init__(self, faq_path='data/faqs.csv', emp_path='data/mock_employee_data.csv',
-                 similarity_threshold=0.45):
-        # Load FAQ data
-        self.faq_df = pd.read_csv(faq_path)
-        self.questions = self.faq_df['question'].astype(str).tolist()
-        self.answers = self.faq_df['answer'].astype(str).tolist()
-        self.categories = self.faq_df['category'].astype(str).tolist()
-
-        # TF-IDF training
-        self.vectorizer = TfidfVectorizer(stop_words='english')
-        self.q_vectors = self.vectorizer.fit_transform(self.questions)
-        self.threshold = similarity_threshold
-
-        # Load employee database (CSV)
-        self.emp_db = pd.read_csv(emp_path)
+                 score_threshold=0.5):
+        # Load FAQ data. The parsed corpus and built BM25 index are pickled
+        # next to the CSV so fresh processes (each Streamlit session) skip
+        # the CSV parse and indexing until the CSV changes.
+        cache_path = faq_path + '.bm25.pkl'
+        faq_mtime = os.path.getmtime(faq_path)
+        cached = self._load_faq_cache(cache_path, faq_mtime)
+        if cached:
+            self.questions = cached['questions']
+            self.answers = cached['answers']
+            self.categories = cached['categories']
+            self.questions_lower = cached['questions_lower']
+            self.tokenizer = cached['tokenizer']
+            self.bm25 = cached['bm25']
+            self.char_vec = cached['char_vec']
+            self.char_q = cached['char_q']
+        else:
+            # Only the columns we use, read as plain strings so the C engine
+            # skips per-column type inference
+            self.faq_df = pd.read_csv(faq_path,
+                                      usecols=['question', 'answer', 'category'],
+                                      dtype=str, engine='c')
+            self.questions = self.faq_df['question'].astype(str).tolist()
+            self.answers = self.faq_df['answer'].astype(str).tolist()
+            self.categories = self.faq_df['category'].astype(str).tolist()
+            # Lowercased questions precomputed once so the fuzzy pass doesn't
+            # re-lowercase the whole corpus on every query
+            self.questions_lower = [q.lower() for q in self.questions]
+
+            # BM25 index over the preprocessed questions (queries are scored
+            # against it in preprocessed form too, see _score_query_uncached).
+            # preprocess already lowercases and strips punctuation, so the
+            # tokenizer is a plain str.split rather than the default regex
+            self.tokenizer = bm25s.tokenization.Tokenizer(
+                lower=False, splitter=str.split, stopwords='en')
+            q_tokens = self.tokenizer.tokenize(
+                [self.preprocess(q) for q in self.questions],
+                update_vocab=True, show_progress=False)
+            self.bm25 = bm25s.BM25()
+            self.bm25.index(q_tokens, show_progress=False)
+
+            # Character n-gram index used instead of edit-distance fuzzy
+            # matching: typos still share most of their 3-4-grams, and a
+            # sparse dot product scores the whole corpus in one call.
+            # Inputs are pre-lowercased, so skip the vectorizer's own pass
+            self.char_vec = TfidfVectorizer(analyzer='char_wb', ngram_range=(3, 4),
+                                            lowercase=False)
+            self.char_q = self.char_vec.fit_transform(self.questions_lower)
+
+            with open(cache_path, 'wb') as f:
+                pickle.dump({'mtime': faq_mtime,
+                             'questions': self.questions,
+                             'answers': self.answers,
+                             'categories': self.categories,
+                             'questions_lower': self.questions_lower,
+                             'tokenizer': self.tokenizer,
+                             'bm25': self.bm25,
+                             'char_vec': self.char_vec,
+                             'char_q': self.char_q}, f)
+
+        # Transposed once so the per-query scoring below is a plain CSR
+        # matmul with no per-call transpose or kernel-wrapper overhead
+        self.char_q_T = self.char_q.T.tocsr()
+
+        # BM25 scores are unbounded (unlike cosine); 0.5 reliably separates
+        # real FAQ hits from no-overlap queries on this corpus
+        self.threshold = score_threshold
+
+        # Memoize recent query scores so retyped/identical queries skip the
+        # transform + kernel entirely (bound per instance, not per class)
+        self._score_query = lru_cache(maxsize=256)(self._score_query_uncached)
+
+        # Load employee database (CSV) and build an id -> record dict so
+        # lookups are a hash probe instead of a boolean scan per call.
+        # Category/int16 dtypes keep the frame small (few distinct
+        # departments/roles/locations, tiny leave counts).
+        self.emp_db = pd.read_csv(
+            emp_path,
+            usecols=['employee_id', 'name', 'department', 'role',
+                     'location', 'paid_leaves', 'sick_leaves'],
+            dtype={'department': 'category', 'role': 'category',
+                   'location': 'category', 'paid_leaves': 'int16',
+                   'sick_leaves': 'int16'},
+            engine='c',
+        )
         self.emp_db['employee_id'] = self.emp_db['employee_id'].str.upper()
+        self.emp_db = self.emp_db.set_index('employee_id', drop=False)
+        self.emp_lookup = self.emp_db.to_dict(orient='index')
 
-        # Short-term context (for one-turn follow-ups)
-        self.last_intent = None       # e.g., 'ask_leave', 'ask_details', 'ask_payslip'
-        self.last_entity = None       # e.g., employee id or other entity to carry over
+        # Employee data is static for the life of the process, so render
+        # both Markdown responses per employee up front; answering becomes
+        # a dict probe with no formatting on the hot path
+        self._leave_responses = {eid: self._LEAVE_TPL.format_map(emp)
+                                 for eid, emp in self.emp_lookup.items()}
+        self._details_responses = {eid: self._DETAILS_TPL.format_map(emp)
+                                   for eid, emp in self.emp_lookup.items()}
+
+        # Precompiled patterns for employee-id handling
+        self._emp_re = re.compile(r"(EMP\d+)", re.IGNORECASE)
+        self._emp_only_re = re.compile(r"^EMP\d+$", re.IGNORECASE)
+
+        # Aho-Corasick automaton over the intent vocabulary: one linear scan
+        # of the query yields a bitmask of every keyword present, and
+        # rule_based dispatches on precomputed group masks in priority order
+        self._kw_fsm = ahocorasick.Automaton()
+        for i, kw in enumerate(self._KEYWORDS):
+            self._kw_fsm.add_word(kw, 1 << i)
+        self._kw_fsm.make_automaton()
+        bit = {kw: 1 << i for i, kw in enumerate(self._KEYWORDS)}
+        self._leave_mask = bit['leave'] | bit['leaves']
+        self._details_mask = bit['details'] | bit['profile']
+        self._payslip_mask = bit['payslip'] | bit['salary'] | bit['payroll']
+        self._bank_mask = bit['bank']
+        self._bank_action_mask = bit['update'] | bit['change']
+
+    # Short-term context (for one-turn follow-ups) lives in a dict owned by
+    # the caller (e.g. st.session_state), never on the shared instance
+    @staticmethod
+    def new_context():
+        return {
+            'last_intent': None,   # e.g., 'ask_leave', 'ask_details', 'ask_payslip'
+            'last_entity': None,   # e.g., employee id or other entity to carry over
+        }
+
+    # -----------------------------
+    # FAQ cache (pickle, keyed by CSV mtime)
+    # -----------------------------
+    _CACHE_KEYS = ('questions', 'answers', 'categories', 'questions_lower',
+                   'tokenizer', 'bm25', 'char_vec', 'char_q')
+
+    @classmethod
+    def _load_faq_cache(cls, cache_path, faq_mtime):
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            with open(cache_path, 'rb') as f:
+                cached = pickle.load(f)
+        except Exception:
+            return None
+        # Stale, unreadable or old-format cache: rebuild from the CSV
+        if cached.get('mtime') != faq_mtime:
+            return None
+        return cached if all(k in cached for k in cls._CACHE_KEYS) else None
 
     # -----------------------------
     # Text preprocessing
@@ -42,100 +172,141 @@ class HRChatbot:
         text = re.sub(r"[^a-z0-9\s]", " ", text)
         return text
 
+    # -----------------------------
+    # BM25 scoring (wrapped by an lru_cache in __init__)
+    # -----------------------------
+    def _score_query_uncached(self, query_p):
+        # bm25s scores the whole corpus in its compiled kernel; k=1 returns
+        # just the best hit and its score. The shared tokenizer maps query
+        # words straight to index vocab ids (unknown words drop out)
+        q_tokens = self.tokenizer.tokenize([query_p], update_vocab=False,
+                                           show_progress=False)
+        idxs, scores = self.bm25.retrieve(q_tokens, k=1, show_progress=False)
+        return int(idxs[0][0]), float(scores[0][0])
+
     # -----------------------------
     # Extract employee id (EMP\d+)
     # -----------------------------
     def extract_employee_id(self, query):
-        match = re.search(r"(EMP\d+)", query.upper())
-        return match.group(1) if match else None
+        # Case-insensitive match so only the short id gets uppercased,
+        # not a copy of the whole query
+        match = self._emp_re.search(query)
+        return match.group(1).upper() if match else None
 
     # -----------------------------
     # Employee CSV lookup
     # -----------------------------
     def get_employee(self, emp_id):
+        # Callers pass ids straight from extract_employee_id, already
+        # uppercased and trimmed
         if emp_id is None:
             return None
-        emp_id = emp_id.upper().strip()
-        row = self.emp_db[self.emp_db['employee_id'] == emp_id]
-        return row.iloc[0] if not row.empty else None
+        return self.emp_lookup.get(emp_id)
 
     # -----------------------------
     # Responses: leave balance & details
     # -----------------------------
+    # Shown whenever nothing matched; built once instead of per miss
+    _FALLBACK_MSG = (
+        "I couldn't find an exact answer. You can try:\n"
+        "- `Check leaves for EMP10234`\n"
+        "- `Show employee details EMP56789`\n"
+        "- `How to download payslip?`"
+    )
+
+    # Markdown templates filled straight from the employee record dicts
+    _LEAVE_TPL = (
+        "### Leave Balance for {name} ({employee_id})\n"
+        "- **Paid Leaves:** {paid_leaves}\n"
+        "- **Sick Leaves:** {sick_leaves}\n"
+        "- **Department:** {department}"
+    )
+    _DETAILS_TPL = (
+        "### Employee Details\n"
+        "- **Name:** {name}\n"
+        "- **Employee ID:** {employee_id}\n"
+        "- **Department:** {department}\n"
+        "- **Role:** {role}\n"
+        "- **Location:** {location}\n"
+        "- **Paid Leaves:** {paid_leaves}\n"
+        "- **Sick Leaves:** {sick_leaves}"
+    )
+
     def leave_balance(self, emp_id):
-        emp = self.get_employee(emp_id)
-        if emp is None:
-            return f"❌ Employee ID **{emp_id}** not found."
-        return (
-            f"### Leave Balance for {emp['name']} ({emp['employee_id']})\n"
-            f"- **Paid Leaves:** {emp['paid_leaves']}\n"
-            f"- **Sick Leaves:** {emp['sick_leaves']}\n"
-            f"- **Department:** {emp['department']}"
-        )
+        return (self._leave_responses.get(emp_id)
+                or f"❌ Employee ID **{emp_id}** not found.")
 
     def employee_details(self, emp_id):
-        emp = self.get_employee(emp_id)
-        if emp is None:
-            return f"❌ Employee ID **{emp_id}** not found."
-        return (
-            f"### Employee Details\n"
-            f"- **Name:** {emp['name']}\n"
-            f"- **Employee ID:** {emp['employee_id']}\n"
-            f"- **Department:** {emp['department']}\n"
-            f"- **Role:** {emp['role']}\n"
-            f"- **Location:** {emp['location']}\n"
-            f"- **Paid Leaves:** {emp['paid_leaves']}\n"
-            f"- **Sick Leaves:** {emp['sick_leaves']}"
-        )
+        return (self._details_responses.get(emp_id)
+                or f"❌ Employee ID **{emp_id}** not found.")
 
     # -----------------------------
     # Rule-based handlers
     # -----------------------------
-    def rule_based(self, query):
+    def _handle_leave(self, q, emp_id, context):
+        # immediate answer if id present
+        if emp_id:
+            return self.leave_balance(emp_id)
+        # store intent so follow-up emp id can be used
+        context['last_intent'] = 'ask_leave'
+        return "Please provide your Employee ID to check leave balance. Example: `EMP10234`"
+
+    def _handle_details(self, q, emp_id, context):
+        if emp_id:
+            return self.employee_details(emp_id)
+        context['last_intent'] = 'ask_details'
+        return "Please provide the Employee ID to fetch details. Example: `EMP56789`"
+
+    def _handle_payslip(self, q, emp_id, context):
+        # not an emp-specific action generally; still clear any pending intent
+        context['last_intent'] = None
+        return "You can download your payslip from **Payroll → Payslips → Select month → Download** in the portal."
+
+    def _handle_bank(self, q, emp_id, context):
+        # rule_based only dispatches here when update/change was also seen
+        context['last_intent'] = None
+        return "To update bank details: Go to **Profile → Bank Details → Edit**, enter new account details and submit. Changes will be verified."
+
+    # Intent vocabulary; automaton bit i corresponds to _KEYWORDS[i]
+    _KEYWORDS = ('leave', 'leaves', 'details', 'profile', 'payslip',
+                 'salary', 'payroll', 'bank', 'update', 'change')
+
+    def rule_based(self, query, context):
         q = query.lower()
+        # Single automaton pass collects every keyword present at once
+        mask = 0
+        for _, kw_bit in self._kw_fsm.iter(q):
+            mask |= kw_bit
+        if not mask:
+            # Generic fallback for short queries (like "EMP10234" or "10234")
+            # If user typed only an ID and last_intent exists, we handle that in retrieve()
+            return None
+        # Only look for an employee id once a keyword actually matched
         emp_id = self.extract_employee_id(query)
-
-        # Leave queries
-        if "leave" in q or "leaves" in q or "leave balance" in q:
-            # store intent and ask for id if not provided
-            if emp_id:
-                # immediate answer if id present
-                return self.leave_balance(emp_id)
-            # store intent so follow-up emp id can be used
-            self.last_intent = 'ask_leave'
-            return "Please provide your Employee ID to check leave balance. Example: `EMP10234`"
-
-        # Employee details/profile
-        if "details" in q or "profile" in q or ("employee" in q and "details" in q):
-            if emp_id:
-                return self.employee_details(emp_id)
-            self.last_intent = 'ask_details'
-            return "Please provide the Employee ID to fetch details. Example: `EMP56789`"
-
-        # Payslip / payroll
-        if "payslip" in q or "salary" in q or "payroll" in q:
-            # not an emp-specific action generally; still set last_intent if required
-            self.last_intent = None
-            return "You can download your payslip from **Payroll → Payslips → Select month → Download** in the portal."
-
-        # Bank update
-        if "bank" in q and ("update" in q or "change" in q):
-            self.last_intent = None
-            return "To update bank details: Go to **Profile → Bank Details → Edit**, enter new account details and submit. Changes will be verified."
-
-        # Generic fallback for short queries (like "EMP10234" or "10234")
-        # If user typed only an ID and last_intent exists, we handle that in retrieve()
+        # Explicit priority: leave > bank update > details > payslip
+        if mask & self._leave_mask:
+            return self._handle_leave(q, emp_id, context)
+        if mask & self._bank_mask and mask & self._bank_action_mask:
+            return self._handle_bank(q, emp_id, context)
+        if mask & self._details_mask:
+            return self._handle_details(q, emp_id, context)
+        if mask & self._payslip_mask:
+            return self._handle_payslip(q, emp_id, context)
         return None
 
     # -----------------------------
     # Main pipeline with short-term memory
     # -----------------------------
-    def retrieve(self, query):
+    def retrieve(self, query, context):
         """
-        Retrieve an answer. This pipeline:
+        Retrieve an answer. `context` is the caller's per-session dict (see
+        `new_context`); it is mutated in place so follow-up state survives
+        between turns without being stored on this shared instance.
+
+        The pipeline:
         1. Checks if query is just an employee ID follow-up and last_intent exists -> fulfills it.
         2. If not, runs rule-based intent detection (which may set last_intent).
-        3. If still unresolved, tries TF-IDF FAQ retrieval + fuzzy fallback.
+        3. If still unresolved, tries BM25 FAQ retrieval + char n-gram fallback.
         """
 
         # Normalize
@@ -144,10 +315,10 @@ class HRChatbot:
 
         # ---- 1) If the user submitted only an employee id (or short id), and we have a last_intent -> fulfill ----
         emp_id_candidate = self.extract_employee_id(raw_query)
-        if emp_id_candidate and self.last_intent:
-            intent = self.last_intent
+        if emp_id_candidate and context['last_intent']:
+            intent = context['last_intent']
             # clear intent after using
-            self.last_intent = None
+            context['last_intent'] = None
 
             if intent == 'ask_leave':
                 return self.leave_balance(emp_id_candidate)
@@ -155,32 +326,60 @@ class HRChatbot:
                 return self.employee_details(emp_id_candidate)
             # no matching intent: fall through
 
+        # ---- 1b) Bare employee id with no pending intent: never a FAQ match,
+        #          so skip vectorization/fuzzy and ask what the user wants ----
+        if self._emp_only_re.match(raw_query):
+            return ("I have the Employee ID, but what would you like to know? "
+                    "Try `Check leaves for " + raw_query.upper() + "` or "
+                    "`Show employee details " + raw_query.upper() + "`.")
+
         # ---- 2) Run rule-based handlers (these may set last_intent) ----
-        rule_resp = self.rule_based(raw_query)
+        rule_resp = self.rule_based(raw_query, context)
         if rule_resp:
             # If rule-based returned a prompt asking for more info (like ID), it already set last_intent.
             return rule_resp
 
-        # ---- 3) TF-IDF retrieval + fuzzy fallback for FAQ answers ----
-        qv = self.vectorizer.transform([query_p])
-        sims = cosine_similarity(qv, self.q_vectors).flatten()
-        best_idx = np.argmax(sims)
-        best_score = sims[best_idx]
+        # ---- 2b) One-word inputs ("hi", a lone number) never carry enough
+        #          signal for retrieval; answer without scoring anything ----
+        if len(query_p.split()) < 2:
+            return self._FALLBACK_MSG
 
-        fuzzy_scores = [fuzz.token_set_ratio(raw_query.lower(), q.lower()) / 100 for q in self.questions]
-        best_fuzzy_score = max(fuzzy_scores) if fuzzy_scores else 0.0
+        # ---- 3) BM25 retrieval + char n-gram fallback for FAQ answers ----
+        best_idx, best_score = self._score_query(query_p)
 
-        if best_score >= self.threshold or best_fuzzy_score >= 0.75:
+        if best_score >= self.threshold:
             # reset context (we answered directly from FAQ)
-            self.last_intent = None
+            context['last_intent'] = None
+            return self.answers[best_idx]
+
+        # Char n-gram fallback only when BM25 missed: catches typos through
+        # shared 3-4-grams. TF-IDF rows are L2-normalized, so the raw
+        # sparse product against the precomputed transpose is the cosine
+        rq_lower = raw_query.lower()
+        cv = self.char_vec.transform([rq_lower])
+        csims = np.asarray((cv @ self.char_q_T).todense()).ravel()
+
+        # Partial top-k selection, then rerank just those candidates with a
+        # token_set_ratio blend: k fuzzy calls instead of N, and the blend
+        # breaks near-ties the n-gram cosine alone gets wrong
+        k = min(5, len(self.questions))
+        best_idx, best_blend = -1, 0.0
+        for i in np.argpartition(csims, -k)[-k:]:
+            blend = (0.6 * csims[i]
+                     + 0.4 * fuzz.token_set_ratio(rq_lower, self.questions_lower[i]) / 100)
+            if blend > best_blend:
+                best_idx, best_blend = int(i), blend
+        if best_blend >= 0.5:
+            context['last_intent'] = None
             return self.answers[best_idx]
 
         # ---- 4) If nothing matched, give friendly fallback ----
-        return "I couldn't find an exact answer. You can try:\n- `Check leaves for EMP10234`\n- `Show employee details EMP56789`\n- `How to download payslip?`"
+        return self._FALLBACK_MSG
 
 # Quick test when running the module directly
 if __name__ == '__main__':
     bot = HRChatbot()
+    ctx = bot.new_context()
     tests = [
         "How many leaves do I have?",
         "EMP10234",               # follow-up should trigger leave answer
@@ -190,5 +389,5 @@ if __name__ == '__main__':
     ]
     for q in tests:
         print("Q:", q)
-        print("A:", bot.retrieve(q))
+        print("A:", bot.retrieve(q, ctx))
         print("---")